@@ -1,22 +1,123 @@
 import os
 import io
+import math
+import importlib.util
 import base64
 import uuid
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+from fractions import Fraction
+from typing import BinaryIO, Iterator
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, url_for
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 
 # Heavy deps imported lazily to reduce cold-start cost
 from ultralytics import YOLO
+from ultralytics.models.yolo.detect import DetectionPredictor
 import cv2
+import torch
+import torch.nn.functional as F
 import numpy as np
-from supabase import create_client, Client
+import httpx
+from PIL import Image
+from supabase import create_client, Client, ClientOptions
+from storage3.utils import StorageException
+
+from letterbox import letterbox_auto, letterbox_params
+
+# Optional libjpeg-turbo bindings; OpenCV's codecs are used when unavailable
+try:
+    from turbojpeg import TurboJPEG
+    turbo_jpeg: TurboJPEG | None = TurboJPEG()
+except Exception:
+    turbo_jpeg = None
 
 
 RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
+# Number of video frames sent to YOLO per predict call
+YOLO_BATCH = max(1, int(os.getenv('YOLO_BATCH', '4')))
+# Concurrent image requests are coalesced into batches of up to MAX_BATCH,
+# waiting at most MAX_WAIT_MS for the batch to fill
+MAX_BATCH = max(1, int(os.getenv('MAX_BATCH', str(YOLO_BATCH))))
+MAX_WAIT_MS = float(os.getenv('MAX_WAIT_MS', '10'))
+BATCH_TIMEOUT_S = float(os.getenv('BATCH_TIMEOUT_S', '30'))
+# Only every Nth video frame is decoded and analyzed
+FRAME_STRIDE = max(1, int(os.getenv('FRAME_STRIDE', '3')))
+# Uploads larger than this are decoded at reduced resolution when possible
+REDUCED_DECODE_MIN_BYTES = int(os.getenv('REDUCED_DECODE_MIN_BYTES', '2000000'))
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', '1024'))
+JPEG_QUALITY = int(os.getenv('JPEG_QUALITY', '95'))
+# Video decoding backend: cv2, decord or pyav
+VIDEO_DECODER = os.getenv('DECODER', 'cv2').lower()
+
+DEVICE = os.getenv('YOLO_DEVICE') or ('0' if torch.cuda.is_available() else 'cpu')
+# Output video codec: mp4v uses OpenCV, anything else (h264_nvenc, libx264, ...) uses PyAV
+VIDEO_CODEC = os.getenv('VIDEO_CODEC') or (
+    'h264_nvenc' if DEVICE != 'cpu' and importlib.util.find_spec('av') is not None else 'mp4v')
+# Shared kwargs for every predict call; FP16 only makes sense on GPU
+PREDICT_KW = dict(
+    verbose=False,
+    half=(DEVICE != 'cpu'),
+    device=DEVICE,
+    imgsz=int(os.getenv('YOLO_IMGSZ', '640')),
+    # Filter in NMS so low-confidence and non-vehicle boxes never reach Python;
+    # COCO 2, 3, 5, 7 = car, motorcycle, bus, truck (empty YOLO_CLASSES keeps all)
+    conf=float(os.getenv('YOLO_CONF', '0.35')),
+    iou=float(os.getenv('YOLO_IOU', '0.45')),
+    classes=[int(c) for c in os.getenv('YOLO_CLASSES', '2,3,5,7').split(',') if c.strip()] or None,
+)
+
+
+class PinnedPredictor(DetectionPredictor):
+    """Detection predictor that uploads batches to the GPU from reusable pinned memory."""
+
+    staging: torch.Tensor | None = None
+
+    def preprocess(self, im):
+        if isinstance(im, torch.Tensor) or self.device.type != 'cuda':
+            return super().preprocess(im)
+        # Equal-sized frames (video batches) are uploaded raw and letterboxed on the GPU;
+        # mixed sizes from the request batcher go through the CPU letterbox first
+        same_shape = len({x.shape for x in im}) == 1
+        frames = im if same_shape else self.pre_transform(im)
+        shape = (len(frames), *frames[0].shape)
+        size = math.prod(shape)
+        # Allocated on first use (not at import) so gunicorn can fork before CUDA
+        # is touched; grows only if a larger batch or frame shape shows up
+        if self.staging is None or self.staging.numel() < size:
+            capacity = max(size, max(MAX_BATCH, YOLO_BATCH) * PREDICT_KW['imgsz'] ** 2 * 3)
+            self.staging = torch.empty(capacity, dtype=torch.uint8).pin_memory()
+        staged = self.staging[:size].view(shape)
+        # Stack straight into pinned memory, with no intermediate batch array. Safe to
+        # reuse across calls: postprocess syncs the stream before the next preprocess
+        np.stack(frames, out=staged.numpy())
+        im = staged.to(self.device, non_blocking=True).permute(0, 3, 1, 2).flip(1)  # BHWC BGR -> BCHW RGB
+        # permute leaves a strided view; TensorRT binds the raw data_ptr() as dense NCHW
+        im = im.contiguous()
+        im = im.half() if self.model.fp16 else im.float()
+        if same_shape:
+            im = self.letterbox_gpu(im)
+        return im / 255
+
+    def letterbox_gpu(self, im: torch.Tensor) -> torch.Tensor:
+        h, w = im.shape[2:]
+        auto = letterbox_auto(getattr(self.args, 'rect', True), self.model)
+        unpad_h, unpad_w, top, bottom, left, right = letterbox_params(h, w, self.imgsz, auto, self.model.stride)
+        if (unpad_h, unpad_w) != (h, w):
+            im = F.interpolate(im, size=(unpad_h, unpad_w), mode='bilinear', align_corners=False)
+        return F.pad(im, (left, right, top, bottom), value=114.0)
+
+
+if DEVICE != 'cpu':
+    PREDICT_KW['predictor'] = PinnedPredictor
+
 
 def get_env(name: str, required: bool = True, default: str | None = None) -> str | None:
     value = os.getenv(name, default)
@@ -28,20 +129,144 @@ def get_env(name: str, required: bool = True, default: str | None = None) -> str
 def init_supabase() -> Client:
     url = get_env('SUPABASE_URL')
     key = get_env('SUPABASE_SERVICE_ROLE_KEY')
-    return create_client(url, key)
+    # One pooled keep-alive HTTP client shared by storage and table calls. A passed-in
+    # client replaces the one storage3 builds, so carry over its 20 s timeout and redirects.
+    http_client = httpx.Client(
+        transport=httpx.HTTPTransport(retries=1),
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=8),
+        timeout=httpx.Timeout(20.0),
+        follow_redirects=True,
+    )
+    try:
+        return create_client(url, key, options=ClientOptions(httpx_client=http_client))
+    except TypeError:
+        # Older supabase-py has no httpx_client option; its sub-clients keep their own sessions
+        http_client.close()
+        return create_client(url, key)
+
+
+def export_onnx_int8(weights: str, out_path: str):
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from ultralytics.data.augment import LetterBox
+    from ultralytics.utils.metrics import box_iou
+
+    # Calibration needs frames like the ones being served; a couple of stock photos
+    # give activation ranges that clip real traffic scenes
+    calib_dir = os.getenv('ONNX_CALIB_DIR')
+    if not calib_dir:
+        raise RuntimeError("ONNX_INT8=1 needs ONNX_CALIB_DIR set to a folder of representative frames")
+    images = [img for name in sorted(os.listdir(calib_dir))
+              if (img := cv2.imread(os.path.join(calib_dir, name))) is not None]
+    # Every fifth frame is held out to compare the int8 model against FP32
+    calib = [img for i, img in enumerate(images) if i % 5 != 4]
+    held_out = images[4::5]
+    if not held_out:
+        raise RuntimeError(f"Need at least 5 calibration images in {calib_dir}, found {len(images)}")
+
+    imgsz = PREDICT_KW['imgsz']
+    fp32_path = YOLO(weights).export(format='onnx', dynamic=True, simplify=True, imgsz=imgsz)
+    input_name = ort.InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    # Static quantization calibrates activation ranges on the sample images,
+    # preprocessed exactly like ultralytics does for an ONNX model
+    letterbox = LetterBox((imgsz, imgsz), auto=False)
+    samples = []
+    for img in calib:
+        x = letterbox(image=img)[..., ::-1].transpose(2, 0, 1)[None]
+        samples.append({input_name: np.ascontiguousarray(x, dtype=np.float32) / 255})
+
+    class SampleReader(CalibrationDataReader):
+        def __init__(self):
+            self.it = iter(samples)
+
+        def get_next(self):
+            return next(self.it, None)
+
+    # QDQ Conv nodes fuse into QLinearConv: uint8 activations x int8 weights (U8S8) run
+    # on VNNI kernels. Only convs are quantized so the box-decoding head stays in FP32.
+    tmp_path = f"{out_path}.tmp"
+    quantize_static(fp32_path, tmp_path, SampleReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    per_channel=True, op_types_to_quantize=['Conv'])
+
+    # Keep the int8 model only if it finds at least 90% of the FP32 detections
+    # (same class, IoU >= 0.5) on the held-out frames
+    fp32_model, int8_model = YOLO(fp32_path, task='detect'), YOLO(tmp_path, task='detect')
+    found = total = 0
+    for img in held_out:
+        ref = fp32_model.predict(img, **PREDICT_KW)[0].boxes
+        got = int8_model.predict(img, **PREDICT_KW)[0].boxes
+        total += len(ref)
+        if len(ref) and len(got):
+            hits = (box_iou(ref.xyxy, got.xyxy) >= 0.5) & (ref.cls[:, None] == got.cls[None])
+            found += int(hits.any(1).sum())
+    if total and found / total < 0.9:
+        os.remove(tmp_path)
+        raise RuntimeError(f"int8 model found only {found}/{total} FP32 detections on held-out frames")
+    os.replace(tmp_path, out_path)
 
 
 def init_model() -> YOLO:
     # Load a small default model; user can override via env
     weights = os.getenv('YOLO_WEIGHTS', 'yolov8n.pt')
+    # Input shapes are fixed per imgsz, so let cuDNN autotune conv kernels
+    torch.backends.cudnn.benchmark = True
+    if os.getenv('TRT_ENABLE') == '1' and weights.endswith('.pt'):
+        try:
+            import tensorrt
+            # The engine's max batch, input size and TensorRT version are baked in, so
+            # they key the cache file
+            batch, imgsz = max(YOLO_BATCH, MAX_BATCH), PREDICT_KW['imgsz']
+            engine_path = f"{os.path.splitext(weights)[0]}-b{batch}-{imgsz}-trt{tensorrt.__version__}.engine"
+            if not os.path.exists(engine_path):
+                # One-time AOT export to a TensorRT FP16 engine next to the weights; the
+                # rename keeps a half-written engine from ever being picked up as cached
+                exported = YOLO(weights).export(format='engine', half=True, dynamic=True, batch=batch,
+                                                imgsz=imgsz)
+                os.replace(exported, engine_path)
+            # YOLO() loads the backend lazily, so run one frame through the engine now
+            engine = YOLO(engine_path, task='detect')
+            try:
+                engine.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), **PREDICT_KW)
+            except Exception:
+                os.remove(engine_path)  # don't keep a broken or stale engine cached across restarts
+                raise
+            return engine
+        except Exception as e:
+            print(f"⚠️ TensorRT engine unavailable, falling back to {weights}: {e}")
+    if os.getenv('ONNX_INT8') == '1' and DEVICE == 'cpu' and weights.endswith('.pt'):
+        onnx_path = os.path.splitext(weights)[0] + '-int8.onnx'
+        try:
+            import onnxruntime as ort
+            if not os.path.exists(onnx_path):
+                export_onnx_int8(weights, onnx_path)
+            # YOLO() loads the backend lazily, so check that ONNX Runtime accepts the model now
+            try:
+                ort.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+            except Exception:
+                os.remove(onnx_path)  # don't keep a broken model cached across restarts
+                raise
+            # Ultralytics runs .onnx files through ONNX Runtime and returns the usual Results
+            return YOLO(onnx_path, task='detect')
+        except Exception as e:
+            print(f"⚠️ ONNX int8 export failed, falling back to {weights}: {e}")
     return YOLO(weights)
 
 
 app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_MB * 1024 * 1024
 CORS(app)
 
 supabase: Client | None = None
 model: YOLO | None = None
+# Class-name lookup for vectorized labels, built from the first Results. Reading
+# model.names up front would load .engine/.onnx backends just to get the names.
+names_arr: np.ndarray | None = None
+# Ultralytics predictors are not thread-safe; serialize predict calls per process
+model_lock = threading.Lock()
+# Supabase uploads/inserts run here so /analyze can respond without waiting on them
+upload_executor = ThreadPoolExecutor(max_workers=int(os.getenv('UPLOAD_WORKERS', '4')))
 
 # Initialize model at startup
 try:
@@ -52,6 +277,67 @@ except Exception as e:
     model = None
 
 
+class Batcher:
+    """Coalesces concurrent single-image predictions into batched model calls."""
+
+    def __init__(self, max_batch: int, max_wait_ms: float):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._pid: int | None = None
+
+    def submit(self, img_bgr: np.ndarray) -> Future:
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((img_bgr, future))
+        return future
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each gunicorn worker starts its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        requests_q = self._queue
+        while True:
+            items = [requests_q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(requests_q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with model_lock:
+                    results_list = model([img for img, _ in items], **PREDICT_KW)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            for (_, future), res in zip(items, results_list):
+                future.set_result(res)
+
+
+batcher = Batcher(MAX_BATCH, MAX_WAIT_MS)
+
+# Initialize Supabase at startup so requests reuse its warm connections
+try:
+    supabase = init_supabase()
+    print("✅ Supabase client initialized successfully")
+except Exception as e:
+    print(f"❌ Failed to initialize Supabase client: {e}")
+    supabase = None
+
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({
@@ -62,56 +348,131 @@ def health():
     })
 
 
-def draw_boxes_on_image(image_bgr: np.ndarray, boxes: np.ndarray, labels: list[str]) -> np.ndarray:
-    annotated = image_bgr.copy()
-    for i, box in enumerate(boxes):
-        x1, y1, x2, y2 = map(int, box[:4])
+def names_to_array(names: dict[int, str]) -> np.ndarray:
+    return np.asarray([names[i] for i in range(len(names))])
+
+
+def get_names_arr(results) -> np.ndarray:
+    global names_arr
+    if names_arr is None:
+        names_arr = names_to_array(results.names)
+    return names_arr
+
+
+def format_labels(names_arr: np.ndarray, cls_ids: np.ndarray, confs: np.ndarray) -> list[str]:
+    # Build "<class> <conf>" labels with NumPy string ops instead of per-box f-strings
+    return np.char.add(np.char.add(names_arr[cls_ids], ' '), np.char.mod('%.2f', confs)).tolist()
+
+
+def draw_boxes_on_image(image_bgr: np.ndarray, boxes: np.ndarray, labels: list[str],
+                        out: np.ndarray | None = None) -> np.ndarray:
+    # Draw into a caller-owned buffer when given, avoiding a fresh copy per frame
+    if out is None or out.shape != image_bgr.shape:
+        annotated = image_bgr.copy()
+    else:
+        np.copyto(out, image_bgr)
+        annotated = out
+    # One vectorized int conversion; tolist() yields plain ints that cv2 accepts
+    for (x1, y1, x2, y2), label in zip(boxes[:, :4].astype(np.int32).tolist(), labels):
         cv2.rectangle(annotated, (x1, y1), (x2, y2), (0, 0, 255), 2)
-        label = labels[i]
         (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
         cv2.rectangle(annotated, (x1, y1 - th - 6), (x1 + tw + 6, y1), (0, 0, 255), -1)
         cv2.putText(annotated, label, (x1 + 3, y1 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
     return annotated
 
 
-def run_yolo_on_image_bytes(file_bytes: bytes):
-    assert model is not None, 'Model not initialized'
+def unpack_detections(results) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # boxes.data is one (N, 6) [x1, y1, x2, y2, conf, cls] tensor: copy it off the GPU once
+    data = results.boxes.data.cpu().numpy()
+    return data[:, :4], data[:, 5].astype(np.int32), data[:, 4]
+
+
+def decode_jpeg_turbo(file_bytes: bytes) -> np.ndarray | None:
+    try:
+        if len(file_bytes) > REDUCED_DECODE_MIN_BYTES:
+            # The header gives the size up front, so pick the scale without a trial decode
+            width, height, _, _ = turbo_jpeg.decode_header(file_bytes)
+            if max(width, height) // 2 >= PREDICT_KW['imgsz']:
+                return turbo_jpeg.decode(file_bytes, scaling_factor=(1, 2))
+        return turbo_jpeg.decode(file_bytes)
+    except OSError:
+        return None
+
+
+def exif_orientation(file_bytes: bytes) -> int:
+    # PIL only parses the header here; the pixel data is never decoded
+    try:
+        with Image.open(io.BytesIO(file_bytes)) as img:
+            return img.getexif().get(0x0112, 1)
+    except Exception:
+        return 1
+
+
+def decode_image_bytes(file_bytes: bytes) -> np.ndarray:
+    # TurboJPEG ignores EXIF orientation while cv2.imdecode applies it, so rotated
+    # photos (typically portrait phone shots) go through OpenCV
+    if (turbo_jpeg is not None and file_bytes[:3] == b'\xff\xd8\xff'
+            and exif_orientation(file_bytes) == 1):
+        img_bgr = decode_jpeg_turbo(file_bytes)
+        if img_bgr is not None:
+            return img_bgr
     np_arr = np.frombuffer(file_bytes, np.uint8)
+    if len(file_bytes) > REDUCED_DECODE_MIN_BYTES:
+        # YOLO letterboxes to imgsz anyway, so large photos can be decoded at half
+        # resolution (libjpeg DCT scaling) as long as they stay above imgsz
+        img_bgr = cv2.imdecode(np_arr, cv2.IMREAD_REDUCED_COLOR_2)
+        if img_bgr is not None and max(img_bgr.shape[:2]) >= PREDICT_KW['imgsz']:
+            return img_bgr
     img_bgr = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    results = model(img_bgr, verbose=False)[0]
-    boxes = results.boxes.xyxy.cpu().numpy() if results.boxes is not None else np.empty((0, 4))
-    cls_ids = results.boxes.cls.cpu().numpy().astype(int) if results.boxes is not None else np.array([], dtype=int)
-    confs = results.boxes.conf.cpu().numpy() if results.boxes is not None else np.array([])
+    if img_bgr is None:
+        raise RuntimeError('Failed to decode image')
+    return img_bgr
+
+
+def run_yolo_on_image_bytes(file_bytes: bytes):
+    assert model is not None, 'Model not initialized'
+    img_bgr = decode_image_bytes(file_bytes)
+    results = batcher.submit(img_bgr).result(timeout=BATCH_TIMEOUT_S)
+    boxes, cls_ids, confs = unpack_detections(results)
     names = results.names
-    labels = [f"{names[c]} {conf:.2f}" for c, conf in zip(cls_ids, confs)]
-    annotated = draw_boxes_on_image(img_bgr, boxes, labels) if len(boxes) > 0 else img_bgr
+    annotated = img_bgr
+    if len(boxes) > 0:
+        annotated = draw_boxes_on_image(img_bgr, boxes, format_labels(get_names_arr(results), cls_ids, confs))
     return img_bgr, annotated, boxes, cls_ids, confs, names
 
 
-def save_image(image_bgr: np.ndarray, out_path: str):
+def save_bytes(data: bytes, out_path: str):
     os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    cv2.imwrite(out_path, image_bgr)
+    with open(out_path, 'wb') as f:
+        f.write(data)
 
 
-def encode_image_to_base64(image_bgr: np.ndarray) -> str:
-    _, buf = cv2.imencode('.jpg', image_bgr)
-    return base64.b64encode(buf.tobytes()).decode('utf-8')
+def encode_image_to_jpeg(image_bgr: np.ndarray) -> bytes:
+    if turbo_jpeg is not None:
+        return turbo_jpeg.encode(image_bgr, quality=JPEG_QUALITY)
+    ok, buf = cv2.imencode('.jpg', image_bgr, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise RuntimeError('Failed to encode image')
+    return buf.tobytes()
 
 
-def upload_to_supabase_storage(client: Client, bucket: str, file_path: str, dest_path: str) -> str:
-    with open(file_path, 'rb') as f:
-        res = client.storage.from_(bucket).upload(dest_path, f, {
-            'contentType': 'image/jpeg' if file_path.lower().endswith(('.jpg', '.jpeg', '.png')) else 'video/mp4',
+def upload_to_supabase_storage(client: Client, bucket: str, file: bytes | BinaryIO, dest_path: str,
+                               content_type: str) -> str:
+    # storage3 raises on failed uploads and returns an UploadResponse, not a dict
+    try:
+        client.storage.from_(bucket).upload(dest_path, file, {
+            'contentType': content_type,
             'upsert': True,
         })
-    if res.get('error'):
-        raise RuntimeError(str(res['error']))
+    except StorageException as e:
+        raise RuntimeError(f"Storage upload failed: {e}") from e
     public_url = client.storage.from_(bucket).get_public_url(dest_path)
     return public_url
 
 
-def insert_violation_record(client: Client, filename: str, violation_type: str, file_url: str):
-    timestamp = datetime.now(timezone.utc).isoformat()
+def insert_violation_record(client: Client, filename: str, violation_type: str, file_url: str,
+                            timestamp: str | None = None):
+    timestamp = timestamp or datetime.now(timezone.utc).isoformat()
     data = {
         'filename': filename,
         'violation_type': violation_type,
@@ -124,6 +485,194 @@ def insert_violation_record(client: Client, filename: str, violation_type: str,
     return data
 
 
+def save_violation(client: Client, bucket: str, source: bytes | str, dest_path: str, content_type: str,
+                   filename: str, violation_type: str, timestamp: str):
+    # Runs on upload_executor, off the request thread; source is JPEG bytes or a file path
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                public_url = upload_to_supabase_storage(client, bucket, f, dest_path, content_type)
+        else:
+            public_url = upload_to_supabase_storage(client, bucket, source, dest_path, content_type)
+        insert_violation_record(client, filename, violation_type, public_url, timestamp)
+    except Exception:
+        app.logger.exception("Failed to save violation %s", dest_path)
+
+
+def open_video_cv2(path: str):
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return None
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 24.0
+
+    def frames() -> Iterator[np.ndarray]:
+        frame_idx = 0
+        try:
+            # grab() advances without the BGR conversion/copy; only retrieve() kept frames
+            while cap.grab():
+                keep = frame_idx % FRAME_STRIDE == 0
+                frame_idx += 1
+                if not keep:
+                    continue
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                yield frame
+        finally:
+            cap.release()
+
+    return frames(), width, height, fps
+
+
+def open_video_decord(path: str):
+    import decord
+    try:
+        vr = decord.VideoReader(path, ctx=decord.cpu(0))
+        if len(vr) == 0:
+            return None
+        height, width = vr[0].shape[:2]
+        fps = vr.get_avg_fps() or 24.0
+    except decord.DECORDError:
+        return None
+
+    def frames(vr: decord.VideoReader) -> Iterator[np.ndarray]:
+        try:
+            # Only the strided frames are decoded, fetched YOLO_BATCH at a time
+            indices = range(0, len(vr), FRAME_STRIDE)
+            for start in range(0, len(indices), YOLO_BATCH):
+                batch = vr.get_batch(list(indices[start:start + YOLO_BATCH])).asnumpy()
+                for rgb in batch:
+                    yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        finally:
+            # decord has no close(); dropping the last reference frees the demuxer
+            del vr
+
+    return frames(vr), width, height, fps
+
+
+def open_video_pyav(path: str):
+    import av
+    try:
+        container = av.open(path)
+    except av.error.FFmpegError:
+        return None
+    if not container.streams.video:
+        container.close()
+        return None
+    stream = container.streams.video[0]
+    stream.thread_type = 'AUTO'
+    width, height = stream.codec_context.width, stream.codec_context.height
+    fps = float(stream.average_rate or 24.0)
+
+    def frames() -> Iterator[np.ndarray]:
+        try:
+            for i, frame in enumerate(container.decode(stream)):
+                # Skipped frames are decoded but never converted to BGR
+                if i % FRAME_STRIDE == 0:
+                    yield frame.to_ndarray(format='bgr24')
+        finally:
+            container.close()
+
+    return frames(), width, height, fps
+
+
+VIDEO_DECODERS = {
+    'cv2': open_video_cv2,
+    'decord': open_video_decord,
+    'pyav': open_video_pyav,
+}
+
+
+def open_video(path: str) -> tuple[Iterator[np.ndarray], int, int, float] | None:
+    if VIDEO_DECODER not in VIDEO_DECODERS:
+        raise RuntimeError(f"Unsupported DECODER: {VIDEO_DECODER}")
+    return VIDEO_DECODERS[VIDEO_DECODER](path)
+
+
+def decode_frames(frames: Iterator[np.ndarray], frames_q: queue.Queue, stop: threading.Event,
+                  errors: list[Exception]):
+    try:
+        for frame in frames:
+            if stop.is_set():
+                break
+            frames_q.put(frame)
+    except Exception as e:
+        # Reported to the request thread; a failed decode must not look like end of stream
+        errors.append(e)
+    finally:
+        frames.close()
+        frames_q.put(None)
+
+
+class PyAVWriter:
+    """cv2.VideoWriter-compatible writer that encodes through PyAV/FFmpeg codecs such as NVENC."""
+
+    def __init__(self, path: str, codec: str, fps: float, size: tuple[int, int]):
+        import av
+        self.av = av
+        # yuv420p needs even dimensions; drop the odd last column/row instead of failing
+        self.width, self.height = size[0] & ~1, size[1] & ~1
+        self.container = av.open(path, 'w', format='mp4')
+        try:
+            self.stream = self.container.add_stream(codec, rate=Fraction(fps).limit_denominator(1001))
+            self.stream.width, self.stream.height = self.width, self.height
+            self.stream.pix_fmt = 'yuv420p'
+            # Open the encoder now so a missing GPU/codec fails before any frame is queued
+            self.stream.codec_context.open()
+        except Exception:
+            self.container.close()
+            raise
+
+    def write(self, frame: np.ndarray):
+        if frame.shape[:2] != (self.height, self.width):
+            frame = np.ascontiguousarray(frame[:self.height, :self.width])
+        av_frame = self.av.VideoFrame.from_ndarray(frame, format='bgr24')
+        self.container.mux(self.stream.encode(av_frame))
+
+    def release(self):
+        self.container.mux(self.stream.encode())  # flush delayed packets
+        self.container.close()
+
+
+# Set once PyAV or its VIDEO_CODEC encoder turns out to be missing, so later
+# requests go straight to mp4v
+video_codec_unavailable = False
+
+
+def open_video_writer(path: str, fps: float, width: int, height: int) -> cv2.VideoWriter | PyAVWriter:
+    global video_codec_unavailable
+    if VIDEO_CODEC != 'mp4v' and not video_codec_unavailable:
+        try:
+            import av
+            missing = VIDEO_CODEC not in av.codecs_available
+        except ImportError:
+            missing = True
+        if missing:
+            video_codec_unavailable = True
+            print(f"⚠️ {VIDEO_CODEC} encoder unavailable, falling back to mp4v")
+        else:
+            try:
+                return PyAVWriter(path, VIDEO_CODEC, fps, (width, height))
+            except Exception as e:
+                # The encoder exists but rejected this video (size, session limit); only it uses mp4v
+                print(f"⚠️ {VIDEO_CODEC} encoder failed for this video, falling back to mp4v: {e}")
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(path, fourcc, fps, (width, height))
+
+
+def write_frames(writer: cv2.VideoWriter | PyAVWriter, out_q: queue.Queue, errors: list[Exception]):
+    while (frame := out_q.get()) is not None:
+        # After a failure keep draining so the request thread never blocks on a full queue
+        if errors:
+            continue
+        try:
+            writer.write(frame)
+        except Exception as e:
+            errors.append(e)
+
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
@@ -131,7 +680,6 @@ def analyze():
             return jsonify({'error': 'No file provided'}), 400
         file = request.files['file']
         filename = file.filename or f"upload_{uuid.uuid4().hex}"
-        content = file.read()
         mimetype = file.mimetype or ''
 
         is_image = mimetype.startswith('image/')
@@ -140,7 +688,7 @@ def analyze():
         if not (is_image or is_video):
             return jsonify({'error': 'Unsupported file type'}), 400
 
-        # Ensure services are ready
+        # Services are initialized at startup; retry here only if that failed
         global supabase, model
         if supabase is None:
             supabase = init_supabase()
@@ -150,79 +698,126 @@ def analyze():
         bucket_name = os.getenv('SUPABASE_BUCKET', 'violations')
 
         if is_image:
-            original_img, annotated_img, boxes, cls_ids, confs, names = run_yolo_on_image_bytes(content)
+            original_img, annotated_img, boxes, cls_ids, confs, names = run_yolo_on_image_bytes(file.read())
             had_detections = len(boxes) > 0
             out_id = uuid.uuid4().hex
-            temp_out_path = os.path.join(RESULTS_DIR, f"{out_id}_annotated.jpg")
-            save_image(annotated_img if had_detections else original_img, temp_out_path)
+            # Encode once and reuse the same JPEG bytes for upload and response
+            jpeg_bytes = encode_image_to_jpeg(annotated_img if had_detections else original_img)
+            if os.getenv('SAVE_RESULTS') == '1':
+                save_bytes(jpeg_bytes, os.path.join(RESULTS_DIR, f"{out_id}_annotated.jpg"))
 
             dest_path = f"images/{out_id}.jpg"
-            public_url = upload_to_supabase_storage(supabase, bucket_name, temp_out_path, dest_path)
-
             violation_type = 'Violation Detected' if had_detections else 'No Violation'
-            record = insert_violation_record(supabase, filename, violation_type, public_url)
+            timestamp = datetime.now(timezone.utc).isoformat()
+            # Upload and insert happen in the background; the public URL only depends on the path
+            upload_executor.submit(save_violation, supabase, bucket_name, jpeg_bytes, dest_path, 'image/jpeg',
+                                   filename, violation_type, timestamp)
+            public_url = supabase.storage.from_(bucket_name).get_public_url(dest_path)
 
-            img_b64 = encode_image_to_base64(annotated_img if had_detections else original_img)
+            img_b64 = base64.b64encode(jpeg_bytes).decode('utf-8')
 
             return jsonify({
                 'type': 'image',
                 'violation': had_detections,
                 'violation_type': violation_type,
-                'timestamp': record['timestamp'],
+                'timestamp': timestamp,
                 'file_url': public_url,
                 'image_base64': img_b64,
             })
 
         # Video path
         temp_in_path = os.path.join(RESULTS_DIR, f"{uuid.uuid4().hex}_{filename}")
-        with open(temp_in_path, 'wb') as f:
-            f.write(content)
+        # Stream the upload to disk in chunks instead of holding the whole video in memory
+        file.save(temp_in_path)
 
-        cap = cv2.VideoCapture(temp_in_path)
-        if not cap.isOpened():
+        video = open_video(temp_in_path)
+        if video is None:
             return jsonify({'error': 'Failed to read video'}), 400
-
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS) or 24.0
+        frames, width, height, fps = video
 
         out_id = uuid.uuid4().hex
         temp_out_path = os.path.join(RESULTS_DIR, f"{out_id}_annotated.mp4")
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        writer = cv2.VideoWriter(temp_out_path, fourcc, fps, (width, height))
+        # Lower the output fps by the stride so playback duration is preserved
+        writer = open_video_writer(temp_out_path, fps / FRAME_STRIDE, width, height)
 
         any_detections = False
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            res = model(frame, verbose=False)[0]
-            boxes = res.boxes.xyxy.cpu().numpy() if res.boxes is not None else np.empty((0, 4))
-            cls_ids = res.boxes.cls.cpu().numpy().astype(int) if res.boxes is not None else np.array([], dtype=int)
-            confs = res.boxes.conf.cpu().numpy() if res.boxes is not None else np.array([])
-            names = res.names
-            labels = [f"{names[c]} {conf:.2f}" for c, conf in zip(cls_ids, confs)]
-            annotated = draw_boxes_on_image(frame, boxes, labels) if len(boxes) > 0 else frame
-            if len(boxes) > 0:
-                any_detections = True
-            writer.write(annotated)
-
-        cap.release()
-        writer.release()
+        # Decode -> infer -> encode run concurrently; None marks end of stream
+        frames_q: queue.Queue = queue.Queue(maxsize=2 * YOLO_BATCH)
+        out_q: queue.Queue = queue.Queue(maxsize=2 * YOLO_BATCH)
+        # Annotation canvases are recycled round-robin; maxsize + 2 guarantees the
+        # writer thread has finished with a buffer before it is drawn into again
+        annotated_bufs = [np.empty((height, width, 3), np.uint8) for _ in range(out_q.maxsize + 2)]
+        stop = threading.Event()
+        # Exceptions raised in the decoder/writer threads, re-raised on this thread
+        errors: list[Exception] = []
+        decoder = threading.Thread(target=decode_frames, args=(frames, frames_q, stop, errors), daemon=True)
+        encoder = threading.Thread(target=write_frames, args=(writer, out_q, errors), daemon=True)
+        decoder.start()
+        encoder.start()
+        try:
+            frame_buf: list[np.ndarray] = []
+            written = 0
+            eof = False
+            while not eof:
+                frame = frames_q.get()
+                if errors:
+                    raise errors[0]
+                if frame is not None:
+                    frame_buf.append(frame)
+                else:
+                    eof = True
+                if not frame_buf or (len(frame_buf) < YOLO_BATCH and not eof):
+                    continue
+                # Batched predict amortizes pre/postprocess over the whole buffer
+                with model_lock:
+                    results_list = model(frame_buf, **PREDICT_KW)
+                for frame, res in zip(frame_buf, results_list):
+                    boxes, cls_ids, confs = unpack_detections(res)
+                    annotated = frame
+                    if len(boxes) > 0:
+                        any_detections = True
+                        labels = format_labels(get_names_arr(res), cls_ids, confs)
+                        out_buf = annotated_bufs[written % len(annotated_bufs)]
+                        annotated = draw_boxes_on_image(frame, boxes, labels, out=out_buf)
+                    out_q.put(annotated)
+                    written += 1
+                if errors:
+                    raise errors[0]
+                frame_buf = []
+        finally:
+            stop.set()
+            out_q.put(None)
+            encoder.join()
+            # Drain so a decoder blocked on a full queue can observe the stop flag
+            while decoder.is_alive():
+                try:
+                    frames_q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            decoder.join()
+            writer.release()
+        # Failures in the last frames only surface once both threads have finished
+        if errors:
+            raise errors[0]
 
         dest_path = f"videos/{out_id}.mp4"
-        public_url = upload_to_supabase_storage(supabase, bucket_name, temp_out_path, dest_path)
         violation_type = 'Violation Detected' if any_detections else 'No Violation'
-        record = insert_violation_record(supabase, filename, violation_type, public_url)
+        timestamp = datetime.now(timezone.utc).isoformat()
+        upload_executor.submit(save_violation, supabase, bucket_name, temp_out_path, dest_path, 'video/mp4',
+                               filename, violation_type, timestamp)
+        # The Supabase copy may still be uploading, so point the player at the local file
+        file_url = url_for('serve_results', filename=os.path.basename(temp_out_path), _external=True)
 
         return jsonify({
             'type': 'video',
             'violation': any_detections,
             'violation_type': violation_type,
-            'timestamp': record['timestamp'],
-            'file_url': public_url,
+            'timestamp': timestamp,
+            'file_url': file_url,
         })
 
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"File exceeds the {MAX_UPLOAD_MB} MB upload limit"}), 413
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -233,7 +828,8 @@ def serve_results(filename: str):
 
 
 if __name__ == '__main__':
+    # Development server only; use gunicorn (see gunicorn_conf.py) in production
     port = int(os.getenv('PORT', '5001'))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEV') == '1')
 
 
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+# Ask torch for an NVML-based CUDA check so probing the GPU in the master
+# does not initialize a CUDA context that forked workers cannot use
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WORKERS', '2'))
+threads = int(os.getenv('THREADS', '2'))
+worker_class = 'gthread'
+# Video analysis can take minutes
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '300'))
+
+# Import app.py once in the master so workers fork with the YOLO weights
+# already loaded (on CPU; each worker moves them to its GPU on first predict).
+# A TensorRT engine creates a CUDA context as soon as it loads, so in that
+# case every worker has to load the model itself.
+preload_app = os.getenv('TRT_ENABLE') != '1'
+
+
+def on_starting(server):
+    if os.getenv('TRT_ENABLE') != '1':
+        return
+    # Build the TensorRT engine once before any worker starts, so workers don't race
+    # on the export files and a long build isn't cut short by the worker timeout.
+    # A subprocess keeps CUDA out of the master; importing app runs the export.
+    server.log.info('Preparing TensorRT engine before starting workers')
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        server.log.warning('TensorRT engine preparation exited with code %s', result.returncode)
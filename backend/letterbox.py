@@ -0,0 +1,26 @@
+# Letterbox geometry for PinnedPredictor's GPU preprocessing in app.py. Kept free of
+# torch/ultralytics imports so tests/test_letterbox.py can run on its own.
+
+
+def letterbox_auto(rect: bool, model) -> bool:
+    # Same choice as DetectionPredictor.pre_transform: rectangular (stride-multiple)
+    # padding only for PyTorch weights or dynamic-shape exports. ultralytics 8.3 marks
+    # the backend with model.pt, later releases with model.format == 'pt'.
+    pt = getattr(model, 'format', None) == 'pt' or getattr(model, 'pt', False)
+    imx = getattr(model, 'format', None) == 'imx' or getattr(model, 'imx', False)
+    return bool(rect and (pt or (getattr(model, 'dynamic', False) and not imx)))
+
+
+def letterbox_params(h: int, w: int, new_shape: tuple[int, int], auto: bool, stride: int):
+    # Same geometry as ultralytics' LetterBox (centered padding), so its postprocess
+    # maps boxes back to the original frames unchanged
+    new_h, new_w = new_shape
+    r = min(new_h / h, new_w / w)
+    unpad_h, unpad_w = round(h * r), round(w * r)
+    dh, dw = new_h - unpad_h, new_w - unpad_w
+    if auto:
+        # Rectangular inference: pad only up to the next stride multiple
+        dh, dw = dh % stride, dw % stride
+    top, bottom = round(dh / 2 - 0.1), round(dh / 2 + 0.1)
+    left, right = round(dw / 2 - 0.1), round(dw / 2 + 0.1)
+    return unpad_h, unpad_w, top, bottom, left, right
@@ -0,0 +1,51 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from letterbox import letterbox_auto, letterbox_params  # noqa: E402
+
+SIZES = [(1080, 1920), (1920, 1080), (720, 1280), (481, 853), (640, 640), (100, 50)]
+
+
+@pytest.mark.parametrize('rect, model, expected', [
+    (True, SimpleNamespace(pt=True, dynamic=False), True),  # ultralytics 8.3 PyTorch weights
+    (True, SimpleNamespace(format='pt'), True),  # 8.4+ PyTorch weights, no .pt attribute
+    (True, SimpleNamespace(pt=False, dynamic=False), False),  # 8.3 static TensorRT engine
+    (True, SimpleNamespace(format='engine'), False),  # 8.4+ static TensorRT engine
+    (True, SimpleNamespace(format='engine', dynamic=True), True),
+    (True, SimpleNamespace(format='imx', dynamic=True), False),
+    (False, SimpleNamespace(format='pt', pt=True), False),
+])
+def test_letterbox_auto(rect, model, expected):
+    assert letterbox_auto(rect, model) is expected
+
+
+@pytest.mark.parametrize('h, w, auto, expected', [
+    (1080, 1920, True, (360, 640, 12, 12, 0, 0)),
+    (1080, 1920, False, (360, 640, 140, 140, 0, 0)),
+    (481, 853, True, (361, 640, 11, 12, 0, 0)),
+    (481, 853, False, (361, 640, 139, 140, 0, 0)),
+    (100, 50, True, (640, 320, 0, 0, 0, 0)),
+    (100, 50, False, (640, 320, 0, 0, 160, 160)),
+])
+def test_letterbox_params(h, w, auto, expected):
+    assert letterbox_params(h, w, (640, 640), auto, 32) == expected
+
+
+@pytest.mark.parametrize('auto', [True, False])
+@pytest.mark.parametrize('h, w', SIZES)
+def test_letterbox_params_match_ultralytics(h, w, auto):
+    LetterBox = pytest.importorskip('ultralytics.data.augment').LetterBox
+    # Black frame, so everything that isn't the gray (114) padding is image content
+    img = np.zeros((h, w, 3), np.uint8)
+    out = LetterBox((640, 640), auto=auto, stride=32)(image=img)
+    unpad_h, unpad_w, top, bottom, left, right = letterbox_params(h, w, (640, 640), auto, 32)
+
+    assert out.shape[:2] == (top + unpad_h + bottom, left + unpad_w + right)
+    content = np.argwhere(out[..., 0] != 114)
+    assert content.min(axis=0).tolist() == [top, left]
+    assert content.max(axis=0).tolist() == [top + unpad_h - 1, left + unpad_w - 1]